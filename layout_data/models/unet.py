@@ -1,25 +1,74 @@
 import torch
 import torch.nn.functional as F
 from torch import nn
+from torch.utils.checkpoint import checkpoint
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 from layout_data.utils.initialize import initialize_weights
 
+try:
+    from liger_kernel.transformers import LigerGroupNorm
+except ImportError:
+    LigerGroupNorm = None
+
+
+class SafeGroupNorm(nn.GroupNorm):
+    """GroupNorm that splits very large inputs along the batch dimension.
+
+    GroupNorm statistics are per-sample, so normalizing sub-batches
+    independently is exact. Splitting sidesteps the numel-overflow and
+    pathological slow-backward paths some backends hit on huge feature
+    maps; below the threshold this is a plain GroupNorm.
+    """
+
+    _numel_limit = 2 ** 29
+
+    def forward(self, x):
+        if x.numel() <= self._numel_limit or x.shape[0] == 1:
+            return super(SafeGroupNorm, self).forward(x)
+        chunks = min(-(-x.numel() // self._numel_limit), x.shape[0])
+        return torch.cat([super(SafeGroupNorm, self).forward(part)
+                          for part in x.chunk(chunks, dim=0)], dim=0)
+
+
+def make_gn(channels):
+    """Build a 32-group GroupNorm, preferring a fused single-pass kernel.
+
+    The native GroupNorm is memory-bound (several passes over the tensor);
+    Liger-Kernel's fused implementation computes stats, normalization and
+    affine in one pass. Falls back to SafeGroupNorm when Liger is absent.
+    """
+    if LigerGroupNorm is not None and torch.cuda.is_available():
+        return LigerGroupNorm(num_channels=channels, num_groups=32)
+    return SafeGroupNorm(32, channels)
+
+
+class Conv1x1(nn.Linear):
+    """A 1x1 convolution expressed as a linear layer over channels.
+
+    A kernel=1 conv is a per-pixel matmul across channels; routing it
+    through F.linear dispatches straight to GEMM (oneDNN sgemm on CPU,
+    tensor-core-friendly shapes on GPU) instead of the conv machinery.
+    On channels_last activations the NHWC permutes are free views.
+    """
+
+    def forward(self, x):
+        x = F.linear(x.permute(0, 2, 3, 1), self.weight, self.bias)
+        return x.permute(0, 3, 1, 2)
+
 
 class _EncoderBlock(nn.Module):
 
     def __init__(self, in_channels, out_channels, dropout=False, polling=True, bn=False):
         super(_EncoderBlock, self).__init__()
-        layers = [
-            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1, padding_mode='reflect'),
-            nn.BatchNorm2d(out_channels) if bn else nn.GroupNorm(32, out_channels),
-            nn.GELU(),
-            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1, padding_mode='reflect'),
-            nn.BatchNorm2d(out_channels) if bn else nn.GroupNorm(32, out_channels),
-            nn.GELU(),
-        ]
-        if dropout:
-            layers.append(nn.Dropout())
-        self.encode = nn.Sequential(*layers)
+        # cuDNN has no reflect-padded conv, so pad explicitly in forward and
+        # run the convs with padding=0 to stay on the implicit-GEMM/Winograd
+        # fast path instead of materializing a padded copy inside conv2d.
+        self.conv1 = nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=0)
+        self.norm1 = nn.BatchNorm2d(out_channels) if bn else make_gn(out_channels)
+        self.conv2 = nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=0)
+        self.norm2 = nn.BatchNorm2d(out_channels) if bn else make_gn(out_channels)
+        self.dropout = dropout
         self.pool = None
         if polling:
             self.pool = nn.MaxPool2d(kernel_size=2, stride=2)
@@ -27,70 +76,321 @@ class _EncoderBlock(nn.Module):
     def forward(self, x):
         if self.pool is not None:
             x = self.pool(x)
-        return self.encode(x)
+        x = F.gelu(self.norm1(self.conv1(F.pad(x, (1, 1, 1, 1), mode='reflect'))))
+        x = F.gelu(self.norm2(self.conv2(F.pad(x, (1, 1, 1, 1), mode='reflect'))))
+        if self.dropout:
+            x = F.dropout(x, training=self.training)
+        return x
 
 
 class _DecoderBlock(nn.Module):
-    def __init__(self, in_channels, middle_channels, out_channels, bn=False):
+    def __init__(self, in_channels, middle_channels, out_channels, bn=False, upsample=False,
+                 up_mode='transpose'):
         super(_DecoderBlock, self).__init__()
-        self.decode = nn.Sequential(
-            nn.Conv2d(in_channels, middle_channels, kernel_size=3, padding=1, padding_mode='reflect'),
-            nn.BatchNorm2d(middle_channels) if bn else nn.GroupNorm(32, middle_channels),
-            nn.GELU(),
-            nn.Conv2d(middle_channels, out_channels, kernel_size=3, padding=1, padding_mode='reflect'),
-            nn.BatchNorm2d(out_channels) if bn else nn.GroupNorm(32, out_channels),
-            nn.GELU()
-        )
+        self.conv1 = nn.Conv2d(in_channels, middle_channels, kernel_size=3, padding=0)
+        self.norm1 = nn.BatchNorm2d(middle_channels) if bn else make_gn(middle_channels)
+        self.up = None
+        if upsample:
+            # Fused conv + 2x upsample: either op writes the upsampled
+            # tensor exactly once, instead of a bilinear interpolate pass
+            # followed by a conv re-reading it.
+            self.conv2 = nn.Conv2d(middle_channels, middle_channels, kernel_size=3, padding=0)
+            self.norm2 = nn.BatchNorm2d(middle_channels) if bn else make_gn(middle_channels)
+            if up_mode == 'pixelshuffle':
+                # a single 1x1 GEMM followed by a shuffle, which is just a
+                # reshape — cheaper than the transposed conv on tensor cores
+                self.up = nn.Sequential(
+                    nn.Conv2d(middle_channels, out_channels * 4, kernel_size=1),
+                    nn.PixelShuffle(2),
+                )
+            else:
+                self.up = nn.ConvTranspose2d(middle_channels, out_channels, kernel_size=2, stride=2)
+        else:
+            self.conv2 = nn.Conv2d(middle_channels, out_channels, kernel_size=3, padding=0)
+            self.norm2 = nn.BatchNorm2d(out_channels) if bn else make_gn(out_channels)
+
+    def forward(self, x):
+        x = F.gelu(self.norm1(self.conv1(F.pad(x, (1, 1, 1, 1), mode='reflect'))))
+        x = F.gelu(self.norm2(self.conv2(F.pad(x, (1, 1, 1, 1), mode='reflect'))))
+        if self.up is not None:
+            x = self.up(x)
+        return x
+
+
+class _FinalBlock(nn.Module):
+    def __init__(self, in_channels, out_channels, bn=False):
+        super(_FinalBlock, self).__init__()
+        self.conv1 = nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=0)
+        self.norm1 = nn.BatchNorm2d(out_channels) if bn else make_gn(out_channels)
+        self.conv2 = nn.Conv2d(out_channels, out_channels, kernel_size=1, padding=0)
+        self.norm2 = nn.BatchNorm2d(out_channels) if bn else make_gn(out_channels)
 
     def forward(self, x):
-        return self.decode(x)
+        x = F.gelu(self.norm1(self.conv1(F.pad(x, (1, 1, 1, 1), mode='reflect'))))
+        x = F.gelu(self.norm2(self.conv2(x)))
+        return x
 
 
 class UNet(nn.Module):
-    def __init__(self, num_classes, in_channels=3, bn=False, factors=2):
+    """U-Net for pixel-wise temperature field regression.
+
+    Safe to run under torch.autocast (BF16/FP16): GroupNorm accumulates its
+    statistics in FP32 internally, and the convs pick up tensor cores.
+
+    Inputs whose H, W are multiples of 16 halve evenly through all four
+    pooling stages, so every decoder's transposed conv lands back on its
+    skip resolution exactly and the forward pass is resample-free; other
+    sizes (e.g. 200) get a bilinear fix-up only at the stages that need it.
+    """
+
+    def __init__(self, num_classes, in_channels=3, bn=False, factors=2, up_mode='transpose',
+                 sample_shape=None):
         super(UNet, self).__init__()
         self.enc1 = _EncoderBlock(in_channels, 32 * factors, polling=False, bn=bn)
         self.enc2 = _EncoderBlock(32 * factors, 64 * factors, bn=bn)
         self.enc3 = _EncoderBlock(64 * factors, 128 * factors, bn=bn)
         self.enc4 = _EncoderBlock(128 * factors, 256 * factors, bn=bn)
         self.polling = nn.AvgPool2d(kernel_size=2, stride=2)
-        self.center = _DecoderBlock(256 * factors, 512 * factors, 256 * factors, bn=bn)
-        self.dec4 = _DecoderBlock(512 * factors, 256 * factors, 128 * factors, bn=bn)
-        self.dec3 = _DecoderBlock(256 * factors, 128 * factors, 64 * factors, bn=bn)
-        self.dec2 = _DecoderBlock(128 * factors, 64 * factors, 32 * factors, bn=bn)
-        self.dec1 = nn.Sequential(
-            nn.Conv2d(64 * factors, 32 * factors, kernel_size=3, padding=1, padding_mode='reflect'),
-            nn.BatchNorm2d(32 * factors) if bn else nn.GroupNorm(32, 32 * factors),
-            nn.GELU(),
-            nn.Conv2d(32 * factors, 32 * factors, kernel_size=1, padding=0),
-            nn.BatchNorm2d(32 * factors) if bn else nn.GroupNorm(32, 32 * factors),
-            nn.GELU(),
-        )
-        self.final = nn.Conv2d(32 * factors, num_classes, kernel_size=1)
+        self.center = _DecoderBlock(256 * factors, 512 * factors, 256 * factors, bn=bn,
+                                    upsample=True, up_mode=up_mode)
+        self.dec4 = _DecoderBlock(512 * factors, 256 * factors, 128 * factors, bn=bn,
+                                  upsample=True, up_mode=up_mode)
+        self.dec3 = _DecoderBlock(256 * factors, 128 * factors, 64 * factors, bn=bn,
+                                  upsample=True, up_mode=up_mode)
+        self.dec2 = _DecoderBlock(128 * factors, 64 * factors, 32 * factors, bn=bn,
+                                  upsample=True, up_mode=up_mode)
+        self.dec1 = _FinalBlock(64 * factors, 32 * factors, bn=bn)
+        self.final = Conv1x1(32 * factors, num_classes)
+        self.use_ckpt = False
+        self._cat_cache = {}
+        self._in_hw = None
+        self._enc_sizes = None
+        self._needs_fix = None
+        self._verify_sizes = False
         initialize_weights(self)
+        # NHWC weights let cuDNN dispatch to the faster channels_last conv and
+        # group_norm kernels on Ampere+ GPUs; a no-op on CPU.
+        self.to(memory_format=torch.channels_last)
+        if sample_shape is not None:
+            self.warm_up(sample_shape)
+
+    def _apply(self, fn, *args, **kwargs):
+        # .to()/.cuda()/.half() would strand the old device's or dtype's
+        # skip buffers in the cache (e.g. the CPU set left by a
+        # construction-time warm_up after the model moves to GPU)
+        self._cat_cache.clear()
+        return super(UNet, self)._apply(fn, *args, **kwargs)
+
+    def warm_up(self, sample_shape=(1, 1, 200, 200)):
+        """Let cuDNN pick the fastest conv algorithm for a fixed shape.
+
+        The 3x3 stride-1 convs here are the canonical Winograd case, but
+        cuDNN only searches algorithms (Winograd vs implicit GEMM, per
+        layer) with benchmark mode on, and it does so lazily on the first
+        forward. Enable the mode and run one throwaway forward so the
+        search cost is paid up front. The choice is cached per input shape,
+        so pair this with fixed-shape training; call again after moving the
+        model to its target device.
+        """
+        if torch.backends.cudnn.is_available():
+            torch.backends.cudnn.benchmark = True
+        was_training = self.training
+        self.eval()
+        with torch.no_grad():
+            self(torch.zeros(*sample_shape, device=next(self.parameters()).device))
+        self.train(was_training)
+        return self
+
+    def enable_conv_checkpointing(self):
+        """Recompute encoder/center activations on backward instead of storing them.
+
+        Trades ~20-30% extra compute for a large cut in peak activation memory,
+        which allows larger batches or deeper factors on the same GPU.
+        """
+        self.use_ckpt = True
+
+    def enable_compile(self, mode='reduce-overhead'):
+        """Compile the forward pass with TorchInductor.
+
+        Inductor fuses the GroupNorm affine and GELU of each block into the
+        post-conv epilogue, removing two full activation read/writes per block.
+        Shapes are fixed during training here, so dynamic=False is safe.
+        """
+        self.forward = torch.compile(self.forward, dynamic=False, fullgraph=False, mode=mode)
+
+    def fuse_bn(self):
+        """Fold every BatchNorm into its preceding conv, in place.
+
+        Only models built with bn=True have BatchNorms; after folding, each
+        block is just Conv + GELU (+ upsample), removing every norm pass at
+        inference for free — the classic advantage of BN over GroupNorm,
+        whose statistics are data dependent and cannot be folded. Call on an
+        eval-mode model. Returns the number of pairs fused.
+        """
+        fused = 0
+        for block in self.modules():
+            for conv_name, norm_name in (('conv1', 'norm1'), ('conv2', 'norm2')):
+                conv = getattr(block, conv_name, None)
+                norm = getattr(block, norm_name, None)
+                if isinstance(conv, nn.Conv2d) and isinstance(norm, nn.BatchNorm2d):
+                    setattr(block, conv_name, fuse_conv_bn_eval(conv, norm))
+                    setattr(block, norm_name, nn.Identity())
+                    fused += 1
+        return fused
+
+    def _cat2(self, a, b):
+        """Concatenate along channels, reusing a cached output buffer.
+
+        torch.cat allocates a fresh combined tensor on every call; the four
+        skip concats are multi-MB of allocator churn per iteration. Outside
+        autograd we copy into a buffer cached per shape instead. Under
+        autograd we fall back to torch.cat, since a reused buffer would be
+        overwritten before backward consumes it.
+        """
+        if torch.is_grad_enabled():
+            return torch.cat([a, b], 1)
+        key = (a.shape, b.shape, a.dtype, a.device)
+        buf = self._cat_cache.get(key)
+        if buf is None:
+            n, ca, h, w = a.shape
+            buf = torch.empty(n, ca + b.shape[1], h, w, dtype=a.dtype, device=a.device)
+            buf = buf.contiguous(memory_format=torch.channels_last)
+            self._cat_cache[key] = buf
+        buf[:, :a.shape[1]].copy_(a)
+        buf[:, a.shape[1]:].copy_(b)
+        return buf
+
+    def _match(self, up, stage):
+        # The transposed convs restore the pre-pool resolution exactly when
+        # H, W halve evenly; only odd sizes (e.g. 25 -> 12 -> 24 at the
+        # center stage for 200x200 input) need the bilinear fix-up. Which
+        # stages that is depends only on the input H, W, so it is decided
+        # once in the size cache — with H, W % 16 == 0 the whole decoder
+        # path is interpolate-free and every stage is static-shape.
+        if self._needs_fix[stage]:
+            up = F.interpolate(up, self._enc_sizes[stage], align_corners=False, mode='bilinear')
+        return up
 
     def forward(self, x):
+        x = x.contiguous(memory_format=torch.channels_last)
+        if x.shape[-2:] != self._in_hw:
+            # The encoder halves H, W at each pooling stage; training runs at
+            # a fixed shape, so cache the four sizes once instead of slicing
+            # torch.Size on every decoder stage of every iteration.
+            self._in_hw = x.shape[-2:]
+            # the skip buffers are tens of MB per shape; keep only the
+            # current working set instead of every shape ever seen
+            self._cat_cache.clear()
+            h, w = self._in_hw
+            sizes, fix = [], []
+            for _ in range(4):
+                sizes.append((h, w))
+                # a 2x transposed conv from the next (floored) stage lands
+                # back on (h, w) exactly iff both dims are even
+                fix.append(h % 2 != 0 or w % 2 != 0)
+                h, w = h // 2, w // 2
+            self._enc_sizes = tuple(sizes)
+            self._needs_fix = tuple(fix)
+            self._verify_sizes = True
         enc1 = self.enc1(x)
-        enc2 = self.enc2(enc1)
-        enc3 = self.enc3(enc2)
-        enc4 = self.enc4(enc3)
-        center = self.center(self.polling(enc4))
-        dec4 = self.dec4(torch.cat([F.interpolate(center, enc4.size()[-2:], align_corners=False,
-                                                  mode='bilinear'), enc4], 1))
-        dec3 = self.dec3(torch.cat([F.interpolate(dec4, enc3.size()[-2:], align_corners=False,
-                                                  mode='bilinear'), enc3], 1))
-        dec2 = self.dec2(torch.cat([F.interpolate(dec3, enc2.size()[-2:], align_corners=False,
-                                                  mode='bilinear'), enc2], 1))
-        dec1 = self.dec1(torch.cat([F.interpolate(dec2, enc1.size()[-2:], align_corners=False,
-                                                  mode='bilinear'), enc1], 1))
+        if self.use_ckpt and self.training:
+            enc2 = checkpoint(self.enc2, enc1, use_reentrant=False)
+            enc3 = checkpoint(self.enc3, enc2, use_reentrant=False)
+            enc4 = checkpoint(self.enc4, enc3, use_reentrant=False)
+            center = checkpoint(self.center, self.polling(enc4), use_reentrant=False)
+        else:
+            enc2 = self.enc2(enc1)
+            enc3 = self.enc3(enc2)
+            enc4 = self.enc4(enc3)
+            center = self.center(self.polling(enc4))
+        if self._verify_sizes:
+            # one-time check per input shape: whenever the fix-up is
+            # disabled, the pool -> convs -> transposed-conv roundtrip must
+            # land back on enc4's resolution with no resampling in between
+            assert self._needs_fix[3] or center.shape[-2:] == enc4.shape[-2:], \
+                'center/enc4 spatial mismatch; use H, W multiples of 16'
+            self._verify_sizes = False
+        dec4 = self.dec4(self._cat2(self._match(center, 3), enc4))
+        dec3 = self.dec3(self._cat2(self._match(dec4, 2), enc3))
+        dec2 = self.dec2(self._cat2(self._match(dec3, 1), enc2))
+        dec1 = self.dec1(self._cat2(self._match(dec2, 0), enc1))
         final = self.final(dec1)
         return final
 
 
+def compile_static(model, shape=(1, 1, 200, 200), package_path=None):
+    """AOT-compile the model for a single fixed input shape.
+
+    torch.export traces the graph with static shapes — the size cache and
+    upsample fix-up decisions constant-fold away — and AOT Inductor then
+    codegens the whole conv/norm/GELU/upsample/cat pipeline into a
+    self-contained .pt2 package with no Python dispatch at run time. Suited
+    to deployments that evaluate single layouts repeatedly. Returns the
+    package path; reload with load_static().
+    """
+    model = model.eval()
+    example = torch.randn(*shape)
+    exported = torch.export.export(model, (example,))
+    return torch._inductor.aoti_compile_and_package(exported, package_path=package_path)
+
+
+def load_static(package_path):
+    """Load a compile_static() package; the result is callable like the model."""
+    return torch._inductor.aoti_load_package(package_path)
+
+
+def quantize_inference(model, calib_loader, shape=(1, 1, 200, 200)):
+    """Post-training INT8 quantization of the conv stack via PT2E.
+
+    Exports the eval-mode graph at a fixed shape, annotates it with the x86
+    Inductor quantizer (per-channel INT8 weights, observed activations, so
+    the convs hit VNNI on server CPUs), calibrates on the batches of
+    ``calib_loader`` and converts. GroupNorm is not annotated by the
+    quantizer and stays FP32 — its kernel quantizes poorly. Roughly
+    quarters the weight/activation bandwidth that dominates this network.
+    Returns the converted GraphModule; the PT2E flow lives in torchao on
+    recent PyTorch and in torch.ao on older releases.
+    """
+    try:
+        from torchao.quantization.pt2e.quantize_pt2e import prepare_pt2e, convert_pt2e
+        from torchao.quantization.pt2e.quantizer.x86_inductor_quantizer import (
+            X86InductorQuantizer, get_default_x86_inductor_quantization_config)
+    except ImportError:
+        from torch.ao.quantization.quantize_pt2e import prepare_pt2e, convert_pt2e
+        from torch.ao.quantization.quantizer.x86_inductor_quantizer import (
+            X86InductorQuantizer, get_default_x86_inductor_quantization_config)
+    model = model.eval()
+    exported = torch.export.export(model, (torch.randn(*shape),)).module()
+    quantizer = X86InductorQuantizer()
+    quantizer.set_global(get_default_x86_inductor_quantization_config())
+    prepared = prepare_pt2e(exported, quantizer)
+    with torch.no_grad():
+        for batch in calib_loader:
+            layout = batch[0] if isinstance(batch, (tuple, list)) else batch
+            prepared(layout)
+    return convert_pt2e(prepared)
+
+
+def make_graphed(model, sample, warmup=3):
+    """Capture forward/backward into a replayable CUDA graph.
+
+    On small-batch 200x200 workloads the per-forward kernel-launch latency
+    (5-6 kernels per block, ~40 in total) rivals the kernel run time;
+    capturing the model replays the whole DAG with one launch. Requires
+    CUDA and a fixed input shape — the cached skip-cat buffers and size
+    table already keep the graph allocation-stable. Feed the returned
+    callable tensors with the same shape/dtype/layout as ``sample``
+    (copy new data into a static input buffer between replays).
+    """
+    sample = sample.cuda().contiguous(memory_format=torch.channels_last)
+    return torch.cuda.make_graphed_callables(model.cuda(), (sample,), num_warmup_iters=warmup)
+
+
 if __name__ == '__main__':
-    model = UNet(in_channels=1, num_classes=1)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = UNet(in_channels=1, num_classes=1).to(device)
     print(model)
-    x = torch.randn(1, 1, 200, 200)
-    with torch.no_grad():
+    x = torch.randn(1, 1, 200, 200, device=device)
+    with torch.no_grad(), torch.autocast(device_type=device, dtype=torch.bfloat16):
         final = model(x)
-        print(final.shape)
+        print(final.shape, final.dtype)